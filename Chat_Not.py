@@ -1,9 +1,44 @@
 # app.py
+import functools
 import math
 import re
 from typing import Dict, List, Tuple
+import numpy as np
 import streamlit as st
 
+# Stem KB and query tokens with PyStemmer (folds "holes"/"hole", "blasting"/"blast").
+# Off by default so retrieval is the same on every host; turning it on
+# requires PyStemmer to be installed.
+USE_STEMMER = False
+if USE_STEMMER:
+    import Stemmer
+    _STEMMER = Stemmer.Stemmer("english")
+else:
+    _STEMMER = None
+
+# ---------------------------
+# Precompiled patterns
+# ---------------------------
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# intent detection: one alternation, one named group per intent keyword set
+_INTENT_RE = re.compile(
+    r"(?P<pf>\bpf\b|\bpowder\s*factor\b)"
+    r"|(?P<sd>\bsd\b|scaled\s*distance|vibration)"
+    r"|(?P<lk>\blk\b|kihl|langefors)"
+    r"|(?P<nobel>\bnobel\b|cartridge)"
+    r"|(?P<bs>burden|spacing)"
+    r"|(?P<rule>rule|start|estimate)",
+    re.I,
+)
+
+# scaled distance operands, e.g. "sd 300 m, 35 kg"
+_SD_DIST_RE   = re.compile(r"(\d+(\.\d+)?)\s*(m|meter|metre|ft)", re.I)
+_SD_CHARGE_RE = re.compile(r"(\d+(\.\d+)?)\s*(kg|lb)", re.I)
+
+# any k=v number pair, e.g. "rho=1000" or "cart_d = 83"
+_KV_RE = re.compile(r"\b([A-Za-z_]+)\s*=\s*([-+]?\d*\.?\d+)")
+
 # ---------------------------
 # Utility helpers
 # ---------------------------
@@ -12,12 +47,10 @@ def parse_kv_numbers(text: str, keys: List[str]) -> Dict[str, float]:
     Parses k=v pairs (numbers) from free text, case-insensitive.
     Example: 'h=10 b=3 s=3 j=0.5 t=2 d=165 rho=1000'
     """
-    out = {}
-    for k in keys:
-        m = re.search(rf"\b{k}\s*=\s*([-+]?\d*\.?\d+)", text, flags=re.I)
-        if m:
-            out[k] = float(m.group(1))
-    return out
+    found: Dict[str, str] = {}
+    for m in _KV_RE.finditer(text):
+        found.setdefault(m.group(1).lower(), m.group(2))  # first occurrence wins
+    return {k: float(found[k.lower()]) for k in keys if k.lower() in found}
 
 def mm_to_m(x_mm: float) -> float:
     return x_mm / 1000.0
@@ -35,6 +68,7 @@ def circle_area(diam_m: float) -> float:
 # ---------------------------
 # Calculation engines
 # ---------------------------
+@st.cache_data(max_entries=256, show_spinner=False)
 def calc_powder_factor(H, B, S, J, T, D_mm, rho):
     """Returns (pf_kg_per_m3, charge_per_hole_kg, charged_length_m, rock_volume_m3)"""
     d_m = mm_to_m(D_mm)
@@ -45,6 +79,7 @@ def calc_powder_factor(H, B, S, J, T, D_mm, rho):
     pf = charge_per_hole / rock_volume if rock_volume > 0 else 0.0
     return pf, charge_per_hole, charged_len, rock_volume
 
+@st.cache_data(max_entries=256, show_spinner=False)
 def calc_scaled_distance(distance, distance_units, charge_kg):
     """Scaled Distance (metric): SD = distance(m) / sqrt(charge_kg_per_delay)"""
     if distance_units.lower() in ["ft", "feet"]:
@@ -55,6 +90,7 @@ def calc_scaled_distance(distance, distance_units, charge_kg):
         return None
     return distance_m / math.sqrt(charge_kg)
 
+@st.cache_data(max_entries=256, show_spinner=False)
 def lk_burden_spacing(D_mm, k, alpha, F):
     """
     A configurable Langefors–Kihlström-style rule of thumb.
@@ -72,6 +108,7 @@ def lk_burden_spacing(D_mm, k, alpha, F):
     S = alpha * B
     return B, S
 
+@st.cache_data(max_entries=256, show_spinner=False)
 def nobel_cartridge_method(charged_len_m, cart_len_m, cart_diam_mm, rho_cart):
     """
     Simple 'Nobel cartridge' style estimate:
@@ -132,38 +169,62 @@ KB = [
     },
 ]
 
-def tokenize(text: str) -> List[str]:
-    return re.findall(r"[a-z0-9]+", text.lower())
+@functools.lru_cache(maxsize=512)
+def tokenize(text: str) -> Tuple[str, ...]:
+    tokens = _TOKEN_RE.findall(text.lower())
+    if _STEMMER is not None:
+        tokens = _STEMMER.stemWords(tokens)
+    return tuple(tokens)
 
 # Light BM25-like retrieval (no heavy deps)
-VOCAB = {}
-DOCS = []
-for item in KB:
-    tokens = tokenize(item["q"] + " " + item["a"])
-    DOCS.append(tokens)
-    for t in set(tokens):
-        VOCAB[t] = VOCAB.get(t, 0) + 1
-
-def bm25_like(query: str, k1=1.5, b=0.75) -> Tuple[int, float]:
-    N = len(DOCS)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+@st.cache_resource(show_spinner=False)
+def _build_kb_index(k1: float = BM25_K1, b: float = BM25_B):
+    """
+    Precompute everything BM25 needs that does not depend on the query:
+    a term -> id map, a dense (num_terms, N) term-frequency matrix (filled
+    from each doc's int32 term-id array), per-term IDF and the per-doc
+    length normaliser k1*(1-b+b*dl/avgdl). The KB is tiny, so dense
+    storage is fine.
+    """
+    term2id: Dict[str, int] = {}
+    doc_term_ids: List[np.ndarray] = []
+    for item in KB:
+        doc = tokenize(item["q"] + " " + item["a"])
+        ids = np.fromiter((term2id.setdefault(t, len(term2id)) for t in doc), dtype=np.int32, count=len(doc))
+        doc_term_ids.append(ids)
+
+    N = len(doc_term_ids)
+    tf = np.zeros((len(term2id), N), dtype=np.float32)
+    for idx, ids in enumerate(doc_term_ids):
+        np.add.at(tf, (ids, idx), 1)
+
+    df = (tf > 0).sum(axis=1)
+    idf = np.log((N - df + 0.5) / (df + 0.5) + 1.0).astype(np.float32)
+    doc_len = tf.sum(axis=0)
+    avgdl = doc_len.mean() if N else 0.0
+    len_norm = k1 * (1 - b + b * (doc_len / avgdl)) if N else doc_len
+    return term2id, tf, idf, len_norm.astype(np.float32)
+
+TERM2ID, TF, IDF, LEN_NORM = _build_kb_index()
+
+def bm25_like(query: str, k1=BM25_K1, b=BM25_B) -> Tuple[int, float]:
+    N = TF.shape[1]
     if N == 0:
         return 0, 0.0
-    avgdl = sum(len(d) for d in DOCS) / N
-    q_terms = tokenize(query)
-    scores = [0.0] * N
-    for qi in set(q_terms):
-        n_qi = VOCAB.get(qi, 0)
-        if n_qi == 0:
-            continue
-        idf = math.log((N - n_qi + 0.5) / (n_qi + 0.5) + 1.0)
-        for idx, doc in enumerate(DOCS):
-            f = doc.count(qi)
-            dl = len(doc)
-            denom = f + k1 * (1 - b + b * (dl / avgdl))
-            scores[idx] += idf * (f * (k1 + 1)) / (denom if denom else 1.0)
-    top_idx = max(range(N), key=lambda i: scores[i])
-    return top_idx, scores[top_idx]
+    len_norm = LEN_NORM if (k1, b) == (BM25_K1, BM25_B) else _build_kb_index(k1, b)[-1]
+    q_ids = np.fromiter((TERM2ID.get(t, -1) for t in set(tokenize(query))), dtype=np.int32)
+    q_ids = q_ids[q_ids >= 0]  # drop terms not in the KB
+    if not q_ids.size:
+        return 0, 0.0
+    tf = TF[q_ids]
+    scores = (IDF[q_ids, None] * (tf * (k1 + 1)) / (tf + len_norm[None, :])).sum(axis=0)
+    top_idx = int(np.argmax(scores))
+    return top_idx, float(scores[top_idx])
 
+@st.cache_data(max_entries=256, show_spinner=False)
 def kb_answer(query: str) -> str:
     idx, _ = bm25_like(query)
     item = KB[idx]
@@ -242,86 +303,94 @@ for m in st.session_state.messages:
     with st.chat_message(m["role"]):
         st.markdown(m["content"])
 
+def _respond_pf(txt: str) -> str:
+    vals = parse_kv_numbers(txt, ["h","b","s","j","t","d","rho"])
+    H   = vals.get("h", st.session_state.defaults["H"])
+    B   = vals.get("b", st.session_state.defaults["B"])
+    S   = vals.get("s", st.session_state.defaults["S"])
+    J   = vals.get("j", st.session_state.defaults["J"])
+    T   = vals.get("t", st.session_state.defaults["T"])
+    Dmm = vals.get("d", st.session_state.defaults["D"])
+    rho = vals.get("rho", st.session_state.defaults["rho"])
+    pf, qhole, Lc, V = calc_powder_factor(H,B,S,J,T,Dmm,rho)
+    return (f"🔢 **Powder Factor**\n"
+            f"- Inputs: H={H:.2f} m, B={B:.2f} m, S={S:.2f} m, J={J:.2f} m, T={T:.2f} m, D={Dmm:.0f} mm, ρ={rho:.0f} kg/m³\n"
+            f"- Charged length Lc = H+J−T = **{Lc:.2f} m**\n"
+            f"- Charge per hole = **{qhole:.1f} kg**\n"
+            f"- Rock volume per hole = **{V:.2f} m³**\n"
+            f"- **PF = {pf:.3f} kg/m³**")
+
+def _respond_sd(txt: str) -> str:
+    # accept patterns like "sd 300 m, 35 kg"
+    md = _SD_DIST_RE.search(txt)
+    mq = _SD_CHARGE_RE.search(txt)
+    if md and mq:
+        dist = float(md.group(1)); du = md.group(3)
+        q = float(mq.group(1)); qu = mq.group(3)
+        if qu.lower() == "lb":
+            q = lb_to_kg(q)
+        sd = calc_scaled_distance(dist, du, q)
+        if sd is None:
+            return "Provide a positive charge per delay."
+        return f"📉 **Scaled Distance** = distance/√charge = **{sd:.2f} m/√kg** (distance={dist} {du}, charge={q:.2f} kg)"
+    else:
+        return "To compute SD, include a distance (m/ft) and charge per delay (kg/lb). Example: `sd 300 m, 35 kg`."
+
+def _respond_lk(txt: str) -> str:
+    vals = parse_kv_numbers(txt, ["d","k","alpha","f"])
+    Dmm   = vals.get("d", st.session_state.defaults["D"])
+    k     = vals.get("k", st.session_state.defaults["lk_k"])
+    alpha = vals.get("alpha", st.session_state.defaults["lk_alpha"])
+    F     = vals.get("f", st.session_state.defaults["lk_F"])
+    B, S = lk_burden_spacing(Dmm, k, alpha, F)
+    return (f"📐 **Langefors–Kihlström (parametric)**\n"
+            f"- D={Dmm:.0f} mm, k={k:.2f}, α={alpha:.2f}, F={F:.2f}\n"
+            f"- **Burden B ≈ {B:.2f} m**, **Spacing S ≈ {S:.2f} m**\n"
+            f"_Tune k/α/F to your site calibration; this keeps the method flexible._")
+
+def _respond_nobel(txt: str) -> str:
+    vals = parse_kv_numbers(txt, ["h","j","t","L","cart_d","rho","d"])
+    H   = vals.get("h", st.session_state.defaults["H"])
+    J   = vals.get("j", st.session_state.defaults["J"])
+    T   = vals.get("t", st.session_state.defaults["T"])
+    L   = vals.get("L", st.session_state.defaults["cart_len"])
+    cart_d = vals.get("cart_d", st.session_state.defaults["cart_diam"])
+    rho_c = vals.get("rho", st.session_state.defaults["cart_rho"])
+    # charged length from bench
+    charged_len = max(H + J - T, 0.0)
+    n, m_cart, m_total = nobel_cartridge_method(charged_len, L, cart_d, rho_c)
+    return (f"🧯 **Nobel / cartridge-based estimate**\n"
+            f"- Charged length Lc ≈ **{charged_len:.2f} m**; cartridge L={L:.2f} m, Ø={cart_d:.0f} mm, ρ={rho_c:.0f} kg/m³\n"
+            f"- Mass per cartridge ≈ **{m_cart:.2f} kg**\n"
+            f"- Estimated number of cartridges ≈ **{n}**\n"
+            f"- **Total charge ≈ {m_total:.1f} kg**\n"
+            f"_Adjust cartridge size/density to match product datasheet._")
+
+def _respond_rules(txt: str) -> str:
+    vals = parse_kv_numbers(txt, ["d"])
+    Dmm = vals.get("d", st.session_state.defaults["D"])
+    B = 30 * mm_to_m(Dmm)
+    S = 1.25 * B
+    T = 25 * mm_to_m(Dmm)
+    return (f"📏 **Starter rules**\n"
+            f"- Burden B ≈ **{B:.2f} m**\n- Spacing S ≈ **{S:.2f} m**\n- Stemming T ≈ **{T:.2f} m**\n"
+            f"(Assumed D={Dmm:.0f} mm; tune for rock/energy/SOP.)")
+
+# (required _INTENT_RE groups) -> handler, in priority order
+_INTENT_HANDLERS = {
+    frozenset({"pf"}):          _respond_pf,      # Powder Factor
+    frozenset({"sd"}):          _respond_sd,      # Scaled Distance
+    frozenset({"lk"}):          _respond_lk,      # Langefors–Kihlström (parametric)
+    frozenset({"nobel"}):       _respond_nobel,   # Nobel cartridge method
+    frozenset({"bs", "rule"}):  _respond_rules,   # Quick burden/spacing rule-of-thumb
+}
+
 def respond(user_text: str) -> str:
     txt = user_text.strip()
-
-    # ---- Powder Factor ------------------------------------------------------
-    if re.search(r"\bpf\b|\bpowder\s*factor\b", txt, flags=re.I):
-        vals = parse_kv_numbers(txt, ["h","b","s","j","t","d","rho"])
-        H   = vals.get("h", st.session_state.defaults["H"])
-        B   = vals.get("b", st.session_state.defaults["B"])
-        S   = vals.get("s", st.session_state.defaults["S"])
-        J   = vals.get("j", st.session_state.defaults["J"])
-        T   = vals.get("t", st.session_state.defaults["T"])
-        Dmm = vals.get("d", st.session_state.defaults["D"])
-        rho = vals.get("rho", st.session_state.defaults["rho"])
-        pf, qhole, Lc, V = calc_powder_factor(H,B,S,J,T,Dmm,rho)
-        return (f"🔢 **Powder Factor**\n"
-                f"- Inputs: H={H:.2f} m, B={B:.2f} m, S={S:.2f} m, J={J:.2f} m, T={T:.2f} m, D={Dmm:.0f} mm, ρ={rho:.0f} kg/m³\n"
-                f"- Charged length Lc = H+J−T = **{Lc:.2f} m**\n"
-                f"- Charge per hole = **{qhole:.1f} kg**\n"
-                f"- Rock volume per hole = **{V:.2f} m³**\n"
-                f"- **PF = {pf:.3f} kg/m³**")
-
-    # ---- Scaled Distance -----------------------------------------------------
-    if re.search(r"\bsd\b|scaled\s*distance|vibration", txt, flags=re.I):
-        # accept patterns like "sd 300 m, 35 kg"
-        md = re.search(r"(\d+(\.\d+)?)\s*(m|meter|metre|ft)", txt, flags=re.I)
-        mq = re.search(r"(\d+(\.\d+)?)\s*(kg|lb)", txt, flags=re.I)
-        if md and mq:
-            dist = float(md.group(1)); du = md.group(3)
-            q = float(mq.group(1)); qu = mq.group(3)
-            if qu.lower() == "lb":
-                q = lb_to_kg(q)
-            sd = calc_scaled_distance(dist, du, q)
-            if sd is None:
-                return "Provide a positive charge per delay."
-            return f"📉 **Scaled Distance** = distance/√charge = **{sd:.2f} m/√kg** (distance={dist} {du}, charge={q:.2f} kg)"
-        else:
-            return "To compute SD, include a distance (m/ft) and charge per delay (kg/lb). Example: `sd 300 m, 35 kg`."
-
-    # ---- Langefors–Kihlström (parametric) -----------------------------------
-    if re.search(r"\blk\b|kihl|langefors", txt, flags=re.I):
-        vals = parse_kv_numbers(txt, ["d","k","alpha","f"])
-        Dmm   = vals.get("d", st.session_state.defaults["D"])
-        k     = vals.get("k", st.session_state.defaults["lk_k"])
-        alpha = vals.get("alpha", st.session_state.defaults["lk_alpha"])
-        F     = vals.get("f", st.session_state.defaults["lk_F"])
-        B, S = lk_burden_spacing(Dmm, k, alpha, F)
-        return (f"📐 **Langefors–Kihlström (parametric)**\n"
-                f"- D={Dmm:.0f} mm, k={k:.2f}, α={alpha:.2f}, F={F:.2f}\n"
-                f"- **Burden B ≈ {B:.2f} m**, **Spacing S ≈ {S:.2f} m**\n"
-                f"_Tune k/α/F to your site calibration; this keeps the method flexible._")
-
-    # ---- Nobel cartridge method ---------------------------------------------
-    if re.search(r"\bnobel\b|cartridge", txt, flags=re.I):
-        vals = parse_kv_numbers(txt, ["h","j","t","L","cart_d","rho","d"])
-        H   = vals.get("h", st.session_state.defaults["H"])
-        J   = vals.get("j", st.session_state.defaults["J"])
-        T   = vals.get("t", st.session_state.defaults["T"])
-        L   = vals.get("L", st.session_state.defaults["cart_len"])
-        cart_d = vals.get("cart_d", st.session_state.defaults["cart_diam"])
-        rho_c = vals.get("rho", st.session_state.defaults["cart_rho"])
-        # charged length from bench
-        charged_len = max(H + J - T, 0.0)
-        n, m_cart, m_total = nobel_cartridge_method(charged_len, L, cart_d, rho_c)
-        return (f"🧯 **Nobel / cartridge-based estimate**\n"
-                f"- Charged length Lc ≈ **{charged_len:.2f} m**; cartridge L={L:.2f} m, Ø={cart_d:.0f} mm, ρ={rho_c:.0f} kg/m³\n"
-                f"- Mass per cartridge ≈ **{m_cart:.2f} kg**\n"
-                f"- Estimated number of cartridges ≈ **{n}**\n"
-                f"- **Total charge ≈ {m_total:.1f} kg**\n"
-                f"_Adjust cartridge size/density to match product datasheet._")
-
-    # ---- Quick burden/spacing rule-of-thumb ---------------------------------
-    if re.search(r"burden|spacing", txt, flags=re.I) and re.search(r"rule|start|estimate", txt, flags=re.I):
-        vals = parse_kv_numbers(txt, ["d"])
-        Dmm = vals.get("d", st.session_state.defaults["D"])
-        B = 30 * mm_to_m(Dmm)
-        S = 1.25 * B
-        T = 25 * mm_to_m(Dmm)
-        return (f"📏 **Starter rules**\n"
-                f"- Burden B ≈ **{B:.2f} m**\n- Spacing S ≈ **{S:.2f} m**\n- Stemming T ≈ **{T:.2f} m**\n"
-                f"(Assumed D={Dmm:.0f} mm; tune for rock/energy/SOP.)")
+    hits = {m.lastgroup for m in _INTENT_RE.finditer(txt)}
+    for groups, handler in _INTENT_HANDLERS.items():
+        if groups <= hits:
+            return handler(txt)
 
     # ---- Otherwise: knowledge base answer -----------------------------------
     return kb_answer(txt)
@@ -1,211 +1,543 @@
 # app.py
 import streamlit as st
-from collections import deque
-from dataclasses import dataclass
 from typing import List, Dict, Optional, Tuple
 import graphviz
+import numpy as np
 import pandas as pd
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the kernels also run as plain Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
 # =========================
 # Core Tic-Tac-Toe logic
 # =========================
-WIN_LINES = [
-    (0,1,2),(3,4,5),(6,7,8),   # rows
-    (0,3,6),(1,4,7),(2,5,8),   # cols
-    (0,4,8),(2,4,6)            # diagonals
-]
-
-def check_winner(board: List[str]) -> Optional[str]:
+# A board is a pair of 9-bit bitboards (x_bb, o_bb); bit i is square i.
+# Winning lines as masks: each octal digit is one board row, top row lowest.
+_WIN_MASKS = np.array([
+    0o007, 0o070, 0o700,   # rows
+    0o111, 0o222, 0o444,   # cols
+    0o421, 0o124           # diagonals
+], dtype=np.uint16)
+FULL_BOARD = 0x1FF
+
+def check_winner(x: int, o: int) -> Optional[str]:
     """Return 'X', 'O', 'Draw', or None."""
-    for a,b,c in WIN_LINES:
-        if board[a] and board[a] == board[b] == board[c]:
-            return board[a]
-    if all(board):
+    if ((x & _WIN_MASKS) == _WIN_MASKS).any():
+        return "X"
+    if ((o & _WIN_MASKS) == _WIN_MASKS).any():
+        return "O"
+    if x | o == FULL_BOARD:
         return "Draw"
     return None
 
-def available_moves(board: List[str]) -> List[int]:
-    return [i for i, v in enumerate(board) if v == ""]
+def available_moves(x: int, o: int) -> List[int]:
+    occupied = x | o
+    return [i for i in range(9) if not (occupied >> i) & 1]
 
-def make_move(board: List[str], idx: int, player: str) -> List[str]:
-    nb = board[:]
-    nb[idx] = player
-    return nb
+def make_move(board: Tuple[int, int], idx: int, player: str) -> Tuple[int, int]:
+    x, o = board
+    if player == "X":
+        return x | (1 << idx), o
+    return x, o | (1 << idx)
 
 def next_player(p: str) -> str:
     return "O" if p == "X" else "X"
 
-def board_str(board: List[str]) -> str:
-    return "".join(v if v else "_" for v in board)
+def to_cells(board: Tuple[int, int]) -> List[str]:
+    """(x_bb, o_bb) -> ['X','','O',...] (only built for what is displayed)"""
+    x, o = board
+    return ["X" if (x >> i) & 1 else ("O" if (o >> i) & 1 else "") for i in range(9)]
+
+def board_str(board: Tuple[int, int]) -> str:
+    return "".join(v if v else "_" for v in to_cells(board))
+
+_SQUARES = np.arange(9)
+_BOARD_CHARS = np.array(["_", "X", "O"])
+
+def board_strs(x_bb: np.ndarray, o_bb: np.ndarray) -> np.ndarray:
+    """Vectorized board_str over arrays of bitboards -> array of 9-char strings."""
+    codes = ((x_bb[:, None] >> _SQUARES) & 1) | (((o_bb[:, None] >> _SQUARES) & 1) << 1)
+    return np.ascontiguousarray(_BOARD_CHARS[codes]).view("<U9").ravel()
+
+# The 8 symmetries of the 3x3 board (4 rotations x optional mirror) as
+# square permutations: _SYMMS[s][i] is where square i lands under symmetry s.
+_SYMMS = [
+    np.array([3 * rr + cc for rr, cc in (f(i // 3, i % 3) for i in range(9))])
+    for f in (
+        lambda r, c: (r, c),          lambda r, c: (c, 2 - r),
+        lambda r, c: (2 - r, 2 - c),  lambda r, c: (2 - c, r),
+        lambda r, c: (r, 2 - c),      lambda r, c: (2 - r, c),
+        lambda r, c: (c, r),          lambda r, c: (2 - c, 2 - r),
+    )
+]
+# _SYM_LUT[s, bb] = bitboard bb with symmetry s applied
+_SYM_LUT = np.array(
+    [[sum(1 << int(p[i]) for i in range(9) if (bb >> i) & 1) for bb in range(512)] for p in _SYMMS],
+    dtype=np.int32,
+)
 
 # =========================
 # Search tree structures
 # =========================
-@dataclass
-class Node:
-    id: int
-    board: List[str]
-    turn: str            # player to move at this node
-    parent: Optional[int]
-    move: Optional[int]  # square index (0..8) taken from parent to here
-    depth: int
-    winner: Optional[str]  # terminal outcome at this node (X/O/Draw/None)
-    order: int           # expansion order (1..N)
-
-def expand_tree(
-    root_board: List[str],
-    root_turn: str,
-    method: str = "BFS",
-    depth_limit: int = 6,
-    max_nodes: int = 2000
-) -> Tuple[Dict[int, Node], List[Tuple[int, int]], Dict[str, int]]:
+# A tree is a struct-of-arrays: node ids are dense 0..N-1 and every column
+# below is a numpy array of length N (see expand_tree).
+#   parent  int32  parent id, -1 for the root
+#   move    int8   square index (0..8) taken from parent to here, -1 for the root
+#   depth   int8
+#   turn    int8   player to move at this node (TURN_CODES)
+#   winner  int8   terminal outcome at this node (WINNER_CODES)
+#   order   int32  expansion order (1..N), 0 if never expanded
+#   x_bb, o_bb int16 bitboards
+Tree = Dict[str, np.ndarray]
+
+# integer codes used by the array-based expansion
+WINNER_CODES = {None: 0, "X": 1, "O": 2, "Draw": 3}
+WINNER_NAMES = (None, "X", "O", "Draw")
+WINNER_LUT = np.array(["", "X", "O", "Draw"])
+TURN_CODES = {"X": 1, "O": 2}
+TURN_NAMES = ("", "X", "O")
+TURN_LUT = np.array(TURN_NAMES)
+# how expand_tree treats a position it has already created
+MERGE_NONE = 0            # plain tree, every move order gets its own node
+MERGE_TRANSPOSITIONS = 1  # same board -> same node
+MERGE_SYMMETRIES = 2      # same board up to rotation/reflection -> same node
+MERGE_NAMES = ("Off", "Transpositions", "Transpositions + symmetries")
+
+@njit(cache=True)
+def _has_line(b):
+    # all 8 _WIN_MASKS tests unrolled and OR-ed together, no early exit
+    return (((b & 0o007) == 0o007) | ((b & 0o070) == 0o070) | ((b & 0o700) == 0o700) |
+            ((b & 0o111) == 0o111) | ((b & 0o222) == 0o222) | ((b & 0o444) == 0o444) |
+            ((b & 0o421) == 0o421) | ((b & 0o124) == 0o124))
+
+@njit(cache=True)
+def _winner_code(x, o):
+    if _has_line(x):
+        return 1
+    if _has_line(o):
+        return 2
+    if x | o == FULL_BOARD:
+        return 3
+    return 0
+
+@njit(cache=True)
+def _position_key(x, o, merge):
+    # index into the transposition table: (x_bb, o_bb) packed as x << 9 | o,
+    # minimized over the 8 board symmetries for MERGE_SYMMETRIES
+    if merge != MERGE_SYMMETRIES:
+        return (x << 9) | o
+    best = 1 << 18
+    for s in range(8):
+        k = (_SYM_LUT[s, x] << 9) | _SYM_LUT[s, o]
+        if k < best:
+            best = k
+    return best
+
+@njit(cache=True)
+def _expand_tree_nb(root_x, root_o, root_turn, method_is_bfs, depth_limit, max_nodes, merge):
     """
-    Build a partial game tree (from current position).
-    Returns nodes dict, edges list, and stats.
+    Pure-integer BFS/DFS expansion. Nodes are rows of parallel arrays;
+    the frontier is a preallocated int32 buffer used as a ring (BFS) or
+    stack (DFS). Returns (parent, move, depth, turn, winner, order, x_bb, o_bb)
+    trimmed to the number of nodes created, followed by the edge columns
+    (edge_u, edge_v, edge_move, edge_sym).
+
+    With a merge mode, a position reached again through a different move
+    order (or, for MERGE_SYMMETRIES, a rotated/mirrored copy of it) is not
+    re-created: the new edge points at the existing node and its subtree is
+    not expanded twice (the tree becomes a DAG). edge_sym marks edges whose
+    target is a symmetric variant rather than the exact board the move made.
+    The transposition table is a flat array indexed by _position_key.
     """
-    nodes: Dict[int, Node] = {}
-    edges: List[Tuple[int, int]] = []
-    nid = 0
-    order = 0
-
-    # create root
-    root = Node(
-        id=nid, board=root_board[:], turn=root_turn,
-        parent=None, move=None, depth=0,
-        winner=check_winner(root_board), order=0
-    )
-    nodes[nid] = root
-
-    # frontier
-    if method.upper() == "BFS":
-        frontier = deque([nid])
-        pop = frontier.popleft
-        push = frontier.append
-    else:  # DFS (LIFO)
-        frontier = [nid]
-        pop = frontier.pop
-        push = frontier.append
-
+    cap = max(max_nodes, 1) + 9  # the last expansion may overshoot by <= 9 children
+    parent = np.full(cap, -1, np.int32)
+    move = np.full(cap, -1, np.int8)
+    depth = np.zeros(cap, np.int8)
+    turn = np.zeros(cap, np.int8)
+    winner = np.zeros(cap, np.int8)
+    order = np.zeros(cap, np.int32)
+    x_bb = np.zeros(cap, np.int16)
+    o_bb = np.zeros(cap, np.int16)
+    frontier = np.empty(cap, np.int32)
+    edge_u = np.empty(cap * 9, np.int32)
+    edge_v = np.empty(cap * 9, np.int32)
+    edge_move = np.empty(cap * 9, np.int8)
+    edge_sym = np.zeros(cap * 9, np.int8)
+    seen = np.full((1 << 18) if merge != MERGE_NONE else 1, -1, np.int32)
+
+    x_bb[0] = root_x
+    o_bb[0] = root_o
+    turn[0] = root_turn
+    winner[0] = _winner_code(root_x, root_o)
+    if merge != MERGE_NONE:
+        seen[_position_key(root_x, root_o, merge)] = 0
+    n = 1
+    e = 0
+    head = 0
+    tail = 0
+    frontier[tail] = 0
+    tail += 1
     expanded = 0
-    term_x = term_o = term_d = 0
 
-    while frontier and len(nodes) < max_nodes:
-        cur_id = pop()
-        cur = nodes[cur_id]
+    while tail > head and n < max_nodes:
+        if method_is_bfs:
+            cur = frontier[head]
+            head += 1
+        else:
+            tail -= 1
+            cur = frontier[tail]
 
-        # mark expansion order
-        order += 1
-        cur.order = order
         expanded += 1
-
-        # tally terminals
-        if cur.winner == "X": term_x += 1
-        if cur.winner == "O": term_o += 1
-        if cur.winner == "Draw": term_d += 1
+        order[cur] = expanded
 
         # stop at terminal or depth limit
-        if cur.winner is not None or cur.depth >= depth_limit:
+        if winner[cur] != 0 or depth[cur] >= depth_limit:
             continue
 
-        # expand children
-        for m in available_moves(cur.board):
-            nid += 1
-            child_board = make_move(cur.board, m, cur.turn)
-            child = Node(
-                id=nid, board=child_board, turn=next_player(cur.turn),
-                parent=cur.id, move=m, depth=cur.depth + 1,
-                winner=check_winner(child_board), order=0
-            )
-            nodes[nid] = child
-            edges.append((cur.id, nid))
-            push(nid)
-
-    stats = {
-        "expanded": expanded,
-        "total_nodes": len(nodes),
-        "X_wins": term_x,
-        "O_wins": term_o,
-        "draws": term_d
+        x = np.int64(x_bb[cur])
+        o = np.int64(o_bb[cur])
+        occupied = x | o
+        for m in range(9):
+            if (occupied >> m) & 1:
+                continue
+            if turn[cur] == 1:
+                cx, co = x | (1 << m), o
+            else:
+                cx, co = x, o | (1 << m)
+            if merge != MERGE_NONE:
+                key = _position_key(cx, co, merge)
+                hit = seen[key]
+                if hit >= 0:
+                    edge_u[e] = cur
+                    edge_v[e] = hit
+                    edge_move[e] = m
+                    edge_sym[e] = x_bb[hit] != cx or o_bb[hit] != co
+                    e += 1
+                    continue
+                seen[key] = n
+            edge_u[e] = cur
+            edge_v[e] = n
+            edge_move[e] = m
+            e += 1
+            parent[n] = cur
+            move[n] = m
+            depth[n] = depth[cur] + 1
+            turn[n] = 3 - turn[cur]
+            winner[n] = _winner_code(cx, co)
+            x_bb[n] = cx
+            o_bb[n] = co
+            frontier[tail] = n
+            tail += 1
+            n += 1
+
+    return (parent[:n], move[:n], depth[:n], turn[:n], winner[:n],
+            order[:n], x_bb[:n], o_bb[:n], edge_u[:e], edge_v[:e], edge_move[:e], edge_sym[:e])
+
+def expand_tree(
+    root_board: Tuple[int, int],
+    root_turn: str,
+    method: str = "BFS",
+    depth_limit: int = 6,
+    max_nodes: int = 2000,
+    merge: int = MERGE_NONE
+) -> Tuple[Tree, np.ndarray, Dict[str, int]]:
+    """
+    Build a partial game tree (from current position).
+    Returns node columns, an (E, 4) array of (from, to, move, sym) edges, and
+    stats. With a merge mode the result is a DAG: a node's "parent" column
+    holds the first parent it was reached from, and its board is the one
+    reached along that parent chain (so loading it needs no un-rotating).
+    """
+    (parent, move, depth, turn, winner, order, x_bb, o_bb,
+     edge_u, edge_v, edge_move, edge_sym) = _expand_tree_nb(
+        root_board[0], root_board[1], TURN_CODES[root_turn],
+        method.upper() == "BFS", depth_limit, max_nodes, merge
+    )
+    nodes: Tree = {
+        "parent": parent, "move": move, "depth": depth, "turn": turn,
+        "winner": winner, "order": order, "x_bb": x_bb, "o_bb": o_bb,
+    }
+    edges = np.stack([edge_u, edge_v, edge_move.astype(np.int32), edge_sym.astype(np.int32)], axis=1)
+    return nodes, edges, tree_stats(nodes, edges)
+
+def tree_stats(nodes: Tree, edges: np.ndarray) -> Dict[str, int]:
+    n = len(nodes["parent"])
+    popped = nodes["order"] > 0
+    winner = nodes["winner"]
+    return {
+        "expanded": int(popped.sum()),
+        "total_nodes": n,
+        "X_wins": int((popped & (winner == 1)).sum()),
+        "O_wins": int((popped & (winner == 2)).sum()),
+        "draws": int((popped & (winner == 3)).sum()),
+        "merged": len(edges) - (n - 1)
     }
-    return nodes, edges, stats
+
+def slice_tree(
+    nodes: Tree,
+    edges: np.ndarray,
+    depth_limit: int,
+    max_nodes: int
+) -> Tuple[Tree, np.ndarray]:
+    """
+    Cut a larger build down to exactly what expand_tree would have returned
+    for a smaller depth_limit / max_nodes, by replaying the node-cap check
+    against the recorded pop order. The build must use the same method and
+    merge setting; a deeper build is only valid for BFS (depth-limited DFS
+    visits nodes in a different order). The result is always an id prefix.
+    """
+    order, depth, parent = nodes["order"], nodes["depth"], nodes["parent"]
+    # pop number that created each non-root node within the depth limit
+    born = np.sort(order[parent[1:]][depth[1:] <= depth_limit])
+    # the smaller run pops k = 1, 2, ... while fewer than max_nodes nodes exist
+    pops = np.arange(1, np.count_nonzero((order > 0) & (depth <= depth_limit)) + 1)
+    n_pops = int(np.count_nonzero(1 + np.searchsorted(born, pops, side="left") < max_nodes))
+    n = 1 + int(np.searchsorted(born, n_pops, side="right"))
+
+    view = {k: v[:n] for k, v in nodes.items()}
+    view["order"] = np.where(view["order"] <= n_pops, view["order"], 0)
+    u = edges[:, 0]
+    keep = (order[u] > 0) & (order[u] <= n_pops) & (depth[u] < depth_limit)
+    return view, edges[keep]
+
+MAX_DEPTH = 9
+MAX_NODES = 5000
+# a BFS slice at depth d pops every depth-d node it keeps, while the full
+# build also expands them (<= 9 children each); 10x headroom covers that
+BUILD_NODES = 10 * MAX_NODES
+
+@st.cache_data(max_entries=32, show_spinner="Expanding game tree…")
+def cached_expand_tree(
+    board: Tuple[int, int],
+    turn: str,
+    method: str,
+    depth_limit: int,
+    merge: int
+) -> Tuple[Tree, np.ndarray, List[str]]:
+    """
+    expand_tree with a BUILD_NODES cap, memoized on its inputs, so reruns
+    that don't change the position or the builder settings skip the
+    expansion entirely. Also returns the node picker labels, indexed by id;
+    only ids that a slice can show (at most MAX_NODES + 8) get one.
+    """
+    nodes, edges, _ = expand_tree(
+        root_board=board,
+        root_turn=turn,
+        method=method,
+        depth_limit=depth_limit,
+        max_nodes=BUILD_NODES,
+        merge=merge
+    )
+    shown = slice(0, MAX_NODES + 9)
+    boards = board_strs(nodes["x_bb"][shown], nodes["o_bb"][shown]).tolist()
+    labels = [f"#{i} — d{d} — {b}" for i, (d, b) in enumerate(zip(nodes["depth"][shown].tolist(), boards))]
+    return nodes, edges, labels
+
+def get_tree(
+    board: Tuple[int, int],
+    turn: str,
+    method: str,
+    depth_limit: int,
+    max_nodes: int,
+    merge: int
+) -> Tuple[Tree, np.ndarray, Dict[str, int], List[str]]:
+    """
+    The tree for the current sidebar settings. BFS is built once to
+    MAX_DEPTH and sliced, so the depth and node sliders never re-expand;
+    DFS is built per depth limit and only sliced by max_nodes.
+    """
+    build_depth = MAX_DEPTH if method.upper() == "BFS" else depth_limit
+    nodes, edges, labels = cached_expand_tree(
+        board, turn, method, build_depth, merge
+    )
+    nodes, edges = slice_tree(nodes, edges, depth_limit, max_nodes)
+    return nodes, edges, tree_stats(nodes, edges), labels
 
 # =========================
 # Graphviz rendering
 # =========================
-def html_board_label(n: Node) -> str:
+def node_board(nodes: Tree, i: int) -> Tuple[int, int]:
+    return int(nodes["x_bb"][i]), int(nodes["o_bb"][i])
+
+# Graphviz HTML label, split around its 10 variable fields (None slots):
+# slot 1 is the header text, the remaining 9 are the cells in square order.
+_LABEL_TMPL = (
+    '<<TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0">\n'
+    '<TR><TD COLSPAN="3"><B>', None, '</B></TD></TR>\n'
+    '<TR><TD>', None, '</TD><TD>', None, '</TD><TD>', None, '</TD></TR>\n'
+    '<TR><TD>', None, '</TD><TD>', None, '</TD><TD>', None, '</TD></TR>\n'
+    '<TR><TD>', None, '</TD><TD>', None, '</TD><TD>', None, '</TD></TR>\n'
+    '</TABLE>>',
+)
+_LABEL_HEADER_SLOT, *_LABEL_CELL_SLOTS = [k for k, part in enumerate(_LABEL_TMPL) if part is None]
+# cell code = x bit | o bit << 1; use nbsp for empty
+CELL_STR = ("&nbsp;", "X", "O")
+
+def html_board_label(nodes: Tree, i: int) -> str:
     """
     HTML-like label for Graphviz with a compact 3x3 grid and a header row.
     """
-    def cell(v):  # use nbsp for empty
-        return v if v else "&nbsp;"
-    status = (f"{n.winner} wins" if n.winner in ("X","O")
-              else ("Draw" if n.winner=="Draw" else f"{n.turn} to move"))
-    header = f"#{n.id} • d{n.depth} • {status} • @{n.order}"
-    b = n.board
-    label = f"""
-    <
-    <TABLE BORDER="0" CELLBORDER="1" CELLSPACING="0">
-      <TR><TD COLSPAN="3"><B>{header}</B></TD></TR>
-      <TR><TD>{cell(b[0])}</TD><TD>{cell(b[1])}</TD><TD>{cell(b[2])}</TD></TR>
-      <TR><TD>{cell(b[3])}</TD><TD>{cell(b[4])}</TD><TD>{cell(b[5])}</TD></TR>
-      <TR><TD>{cell(b[6])}</TD><TD>{cell(b[7])}</TD><TD>{cell(b[8])}</TD></TR>
-    </TABLE>
-    >
-    """
-    return label
-
-def color_for(n: Node) -> str:
-    if n.parent is None:      # root
+    winner = WINNER_NAMES[nodes["winner"][i]]
+    status = (f"{winner} wins" if winner in ("X","O")
+              else ("Draw" if winner=="Draw" else f"{TURN_NAMES[nodes['turn'][i]]} to move"))
+    parts = list(_LABEL_TMPL)
+    parts[_LABEL_HEADER_SLOT] = f"#{i} • d{nodes['depth'][i]} • {status} • @{nodes['order'][i]}"
+    x, o = node_board(nodes, i)
+    for sq, slot in enumerate(_LABEL_CELL_SLOTS):
+        parts[slot] = CELL_STR[(x >> sq) & 1 | ((o >> sq) & 1) << 1]
+    return "".join(parts)
+
+def color_for(nodes: Tree, i: int) -> str:
+    winner = nodes["winner"][i]
+    if nodes["parent"][i] == -1:  # root
         return "#DBEAFE"      # light blue
-    if n.winner == "X":
+    if winner == 1:
         return "#C8FACC"      # pale green
-    if n.winner == "O":
+    if winner == 2:
         return "#FFD1D1"      # pale red
-    if n.winner == "Draw":
+    if winner == 3:
         return "#EEEEEE"      # grey
     return "#FFFFFF"          # white
 
-def path_to_root(nodes: Dict[int, Node], target_id: int) -> List[int]:
-    path = []
-    cur = nodes.get(target_id)
-    while cur is not None:
-        path.append(cur.id)
-        cur = nodes.get(cur.parent) if cur.parent is not None else None
-    return list(reversed(path))
+def path_to_root(parent_arr: np.ndarray, i: int) -> List[int]:
+    """Node ids from the root down to i; the root's parent is -1."""
+    out = []
+    while i != -1:
+        out.append(i)
+        i = int(parent_arr[i])
+    return out[::-1]
 
-def render_graph(
-    nodes: Dict[int, Node],
-    edges: List[Tuple[int, int]],
-    highlight_path: Optional[List[int]] = None
-) -> graphviz.Digraph:
-    if highlight_path is None:
-        highlight_path = []
+HIGHLIGHT_EDGE_ATTRS = {"color": "#2563EB", "penwidth": "3"}  # blue highlight
 
-    path_edges = set()
-    for i in range(len(highlight_path)-1):
-        path_edges.add((highlight_path[i], highlight_path[i+1]))
+def _edge_label(mv: int, sym: int) -> str:
+    # human-friendly 1..9 cell index; ↻ = lands on a rotated/mirrored node
+    return f"{mv+1} ↻" if sym else str(mv+1)
 
-    dot = graphviz.Digraph(
+def _edge_stmt(u: int, v: int, label: str, **attrs) -> str:
+    g = graphviz.Digraph()
+    g.edge(str(u), str(v), label=label, **attrs)
+    return g.body[0]
+
+def _new_dot() -> graphviz.Digraph:
+    return graphviz.Digraph(
         "ttt",
         node_attr={"shape": "box", "fontname": "Helvetica"},
         graph_attr={"rankdir": "TB", "splines": "true"}
     )
+
+def _add_node(dot: graphviz.Digraph, nodes: Tree, i: int) -> None:
+    dot.node(
+        str(i),
+        label=html_board_label(nodes, i),
+        style="filled",
+        fillcolor=color_for(nodes, i)
+    )
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def build_base_dot(
+    board: Tuple[int, int],
+    turn: str,
+    method: str,
+    depth_limit: int,
+    max_nodes: int,
+    merge: int
+) -> Tuple[graphviz.Digraph, Dict[Tuple[int, int], Tuple[int, str]]]:
+    """
+    The full DOT for one tree, with every node and edge in its default style.
+    Keyed like get_tree, so it is only rebuilt when the visible tree changes.
+    Also returns (u, v) -> (index into dot.body, label) so render_graph can
+    restyle single edges without regenerating the rest.
+    """
+    nodes, edges, _, _ = get_tree(
+        board, turn, method, depth_limit, max_nodes, merge
+    )
+    dot = _new_dot()
     # nodes
-    for n in nodes.values():
-        dot.node(
-            str(n.id),
-            label=html_board_label(n),
-            style="filled",
-            fillcolor=color_for(n)
-        )
+    for i in range(len(nodes["parent"])):
+        _add_node(dot, nodes, i)
     # edges
-    for u, v in edges:
-        # label with human-friendly 1..9 cell index
-        mv = nodes[v].move
-        attrs = {}
-        if (u, v) in path_edges:
-            attrs = {"color": "#2563EB", "penwidth": "3"}  # blue highlight
-        dot.edge(str(u), str(v), label=str(mv+1), **attrs)
+    edge_index: Dict[Tuple[int, int], Tuple[int, str]] = {}
+    for u, v, mv, sym in edges.tolist():
+        label = _edge_label(mv, sym)
+        if not sym:  # several moves can reach the same symmetric node; paths use the plain one
+            edge_index[(u, v)] = (len(dot.body), label)
+        dot.edge(str(u), str(v), label=label)
+    return dot, edge_index
+
+def render_graph(
+    base: graphviz.Digraph,
+    edge_index: Dict[Tuple[int, int], Tuple[int, str]],
+    highlight_path: Optional[List[int]] = None
+) -> graphviz.Digraph:
+    """Copy the cached base graph and restyle only the edges on highlight_path."""
+    dot = base.copy()
+    for u, v in zip(highlight_path or [], (highlight_path or [])[1:]):
+        pos, label = edge_index[(u, v)]
+        dot.body[pos] = _edge_stmt(u, v, label, **HIGHLIGHT_EDGE_ATTRS)
+    return dot
+
+def subtree_sizes(nodes: Tree) -> np.ndarray:
+    """Node count of each id's subtree along the first-parent links, itself included."""
+    parent, depth = nodes["parent"], nodes["depth"]
+    size = np.ones(len(parent), np.int64)
+    # children are always one ply deeper, so fold sizes up level by level
+    for d in range(int(depth.max()), 0, -1):
+        ids = np.flatnonzero(depth == d)
+        np.add.at(size, parent[ids], size[ids])
+    return size
+
+def visible_window(parent: np.ndarray, highlight_path: List[int], radius: int) -> np.ndarray:
+    """
+    Boolean mask of the nodes worth drawing: the highlight path plus
+    everything at most `radius` plies below one of its nodes. The mask is
+    closed under parents, so each hidden subtree hangs off a visible node.
+    """
+    on_path = np.zeros(len(parent), bool)
+    on_path[highlight_path] = True
+    visible = on_path.copy()
+    anc = np.arange(len(parent))
+    for _ in range(radius):
+        anc = np.where(anc >= 0, parent[anc], -1)
+        visible |= (anc >= 0) & on_path[anc]
+    return visible
+
+PLACEHOLDER_ATTRS = {"shape": "plaintext", "fontname": "Helvetica", "fontcolor": "#6B7280"}
+
+def render_window(
+    nodes: Tree,
+    edges: np.ndarray,
+    highlight_path: List[int],
+    radius: int
+) -> graphviz.Digraph:
+    """
+    Draw only visible_window(highlight_path, radius); every visible node with
+    hidden children gets one "(+N nodes)" placeholder standing in for them.
+    Edges into hidden nodes (including merged ones) are left out.
+    """
+    parent = nodes["parent"]
+    visible = visible_window(parent, highlight_path, radius)
+    # hidden subtree roots are hidden nodes with a visible parent
+    cut = np.flatnonzero(~visible & (parent >= 0))
+    cut = cut[visible[parent[cut]]]
+    hidden = np.zeros(len(parent), np.int64)
+    np.add.at(hidden, parent[cut], subtree_sizes(nodes)[cut])
+
+    dot = _new_dot()
+    for i in np.flatnonzero(visible).tolist():
+        _add_node(dot, nodes, i)
+    for u in np.flatnonzero(hidden).tolist():
+        dot.node(f"more{u}", label=f"(+{hidden[u]} nodes)", **PLACEHOLDER_ATTRS)
+        dot.edge(str(u), f"more{u}", style="dashed", color="#9CA3AF")
+    on_path = set(zip(highlight_path, highlight_path[1:]))
+    shown = edges[visible[edges[:, 0]] & visible[edges[:, 1]]]
+    for u, v, mv, sym in shown.tolist():
+        attrs = HIGHLIGHT_EDGE_ATTRS if (u, v) in on_path and not sym else {}
+        dot.edge(str(u), str(v), label=_edge_label(mv, sym), **attrs)
     return dot
 
 # =========================
@@ -217,7 +549,7 @@ st.caption("Play the game and explore the game tree. Change the depth/algorithm
 
 # --- Session state ---
 if "board" not in st.session_state:
-    st.session_state.board = ["" for _ in range(9)]
+    st.session_state.board = (0, 0)  # (x_bb, o_bb)
     st.session_state.turn = "X"
     st.session_state.winner = None
 
@@ -225,15 +557,25 @@ if "board" not in st.session_state:
 with st.sidebar:
     st.header("Controls")
     if st.button("🔄 Reset Game"):
-        st.session_state.board = ["" for _ in range(9)]
+        st.session_state.board = (0, 0)
         st.session_state.turn = "X"
         st.session_state.winner = None
         st.rerun()
 
     st.subheader("Tree Builder")
     method = st.radio("Search Method", ["BFS", "DFS"], horizontal=True)
-    depth = st.slider("Depth limit (plies)", 1, 9, 6, 1, help="Number of half-moves from the current position.")
-    max_nodes = st.slider("Max nodes", 50, 5000, 1500, 50)
+    depth = st.slider("Depth limit (plies)", 1, MAX_DEPTH, 6, 1, help="Number of half-moves from the current position.")
+    max_nodes = st.slider("Max nodes", 50, MAX_NODES, 1500, 50)
+    merge = st.selectbox(
+        "Merge positions", [MERGE_NONE, MERGE_TRANSPOSITIONS, MERGE_SYMMETRIES], index=0,
+        format_func=MERGE_NAMES.__getitem__,
+        help="Reuse the node for a position reached by a different move order, optionally "
+             "also for its rotations/reflections (the tree becomes a DAG; ↻ marks symmetric edges)."
+    )
+    expand_all = st.toggle("Expand all", value=False,
+                           help="Draw every node. Slow for large trees; by default only a window around the highlighted path is drawn.")
+    window = st.slider("Plies shown below the path", 0, 3, 2, 1, disabled=expand_all,
+                       help="Deeper subtrees are collapsed into a (+N nodes) placeholder.")
 
 # --- Board UI (immersive) ---
 st.markdown("""
@@ -249,15 +591,16 @@ left, right = st.columns([1,1])
 with left:
     st.subheader("Game Board")
     grid_cols = st.columns(3, gap="small")
+    cells = to_cells(st.session_state.board)
 
     for i in range(9):
         c = grid_cols[i % 3]
         with c:
-            label = st.session_state.board[i] if st.session_state.board[i] else " "
-            disabled = st.session_state.board[i] != "" or st.session_state.winner is not None
+            label = cells[i] if cells[i] else " "
+            disabled = cells[i] != "" or st.session_state.winner is not None
             if st.button(label, key=f"sq_{i}", use_container_width=True, disabled=disabled):
-                st.session_state.board[i] = st.session_state.turn
-                st.session_state.winner = check_winner(st.session_state.board)
+                st.session_state.board = make_move(st.session_state.board, i, st.session_state.turn)
+                st.session_state.winner = check_winner(*st.session_state.board)
                 if not st.session_state.winner:
                     st.session_state.turn = next_player(st.session_state.turn)
                 st.rerun()
@@ -272,36 +615,35 @@ with left:
         st.info(f"Turn: **{st.session_state.turn}**")
 
 # --- Build tree from current position ---
-nodes, edges, stats = expand_tree(
-    root_board=st.session_state.board,
-    root_turn=st.session_state.turn,
-    method=method,
-    depth_limit=depth,
-    max_nodes=max_nodes
-)
+tree_key = (st.session_state.board, st.session_state.turn, method, depth, max_nodes, merge)
+nodes, edges, stats, labels = get_tree(*tree_key)
 
 # --- Right panel: visualizer + explorer ---
 with right:
     st.subheader("Game-Tree Visualizer")
     # selection to highlight a node path, and optional load
-    selectable_ids = sorted(nodes.keys())
+    selectable_ids = list(range(stats["total_nodes"]))
     select_id = st.selectbox(
         "Highlight a node (path from root will be emphasized):",
         selectable_ids,
         index=0,
-        format_func=lambda i: f"#{i} — d{nodes[i].depth} — {board_str(nodes[i].board)}"
+        format_func=labels.__getitem__
     )
-    path = path_to_root(nodes, select_id)
-    dot = render_graph(nodes, edges, highlight_path=path)
+    path = path_to_root(nodes["parent"], select_id)
+    if expand_all:
+        base_dot, edge_index = build_base_dot(*tree_key)
+        dot = render_graph(base_dot, edge_index, highlight_path=path)
+    else:
+        dot = render_window(nodes, edges, path, window)
     st.graphviz_chart(dot, use_container_width=True)
 
     # load button to replace board with chosen node
     st.markdown("**Load the selected node onto the game board**")
     if st.button("⬇️ Load position"):
-        nb = nodes[select_id].board[:]
+        nb = node_board(nodes, select_id)
         st.session_state.board = nb
-        st.session_state.turn = nodes[select_id].turn
-        st.session_state.winner = check_winner(nb)
+        st.session_state.turn = TURN_NAMES[nodes["turn"][select_id]]
+        st.session_state.winner = check_winner(*nb)
         st.rerun()
 
 # --- Explorer table and stats ---
@@ -310,15 +652,16 @@ colA, colB = st.columns([2,1], vertical_alignment="center")
 
 with colA:
     st.subheader("Node Explorer")
+    has_parent = nodes["parent"] >= 0
     df = pd.DataFrame({
-        "id": [n.id for n in nodes.values()],
-        "depth": [n.depth for n in nodes.values()],
-        "to_move": [n.turn for n in nodes.values()],
-        "winner": [n.winner if n.winner else "" for n in nodes.values()],
-        "parent": [n.parent for n in nodes.values()],
-        "move(1..9)": [(n.move + 1) if n.move is not None else None for n in nodes.values()],
-        "expand_order": [n.order for n in nodes.values()],
-        "board": [board_str(n.board) for n in nodes.values()],
+        "id": np.arange(stats["total_nodes"]),
+        "depth": nodes["depth"],
+        "to_move": np.take(TURN_LUT, nodes["turn"]),
+        "winner": np.take(WINNER_LUT, nodes["winner"]),
+        "parent": np.where(has_parent, nodes["parent"], np.nan),
+        "move(1..9)": np.where(has_parent, nodes["move"] + 1, np.nan),
+        "expand_order": nodes["order"],
+        "board": board_strs(nodes["x_bb"], nodes["o_bb"]),
     }).sort_values(["depth","expand_order","id"], kind="stable")
     st.dataframe(df, use_container_width=True, height=320)
 
@@ -326,6 +669,7 @@ with colB:
     st.subheader("Stats")
     st.metric("Nodes expanded", stats["expanded"])
     st.metric("Total nodes", stats["total_nodes"])
+    st.metric("Merged positions", stats["merged"])
     c1, c2, c3 = st.columns(3)
     c1.metric("X wins", stats["X_wins"])
     c2.metric("O wins", stats["O_wins"])
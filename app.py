@@ -1,195 +1,287 @@
 # app.py
 import math
 import re
+import threading
+from collections import Counter, deque
 from typing import List, Dict, Tuple
+import numpy as np
 import streamlit as st
 
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # numba is optional; the kernels also run as plain Python
+    HAVE_NUMBA = False
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+# Patterns for the tokenizer and the chat router, compiled once
+NUMS_RE = re.compile(r"(b|s|h|j|t|d|rho|pf)\s*=\s*([0-9]*\.?[0-9]+)")
+DIST_RE = re.compile(r"(\d+\.?\d*)\s*(m|meter|metre|ft)\b")
+CHARGE_RE = re.compile(r"(\d+\.?\d*)\s*(kg|lb)\b")
+INTENT_RE = re.compile(
+    r"(?P<pf>powder factor|\bpf\b)"
+    r"|(?P<sd>scaled distance|\bsd\b|vibration)"
+    r"|(?P<burden>burden)"
+    r"|(?P<spacing>spacing)"
+    r"|(?P<rule>estimate|rule|start)"
+)
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+# KB answers get a PF example appended when the question sounds like a calc
+CALC_HINT_RE = re.compile(r"calculate|how much|compute|powder factor| pf|pf ")
+
 # ---------------------------
 # Utilities
 # ---------------------------
 
+# unit factors; hot paths multiply by these inline rather than calling the helpers
+IN_TO_M = 0.0254
+FT_TO_M = 0.3048
+LB_TO_KG = 0.453592
+_PI_OVER_4 = math.pi / 4.0
+
 def mm_to_m(x_mm: float) -> float:
     return x_mm / 1000.0
 
 def inches_to_m(x_in: float) -> float:
-    return x_in * 0.0254
+    return x_in * IN_TO_M
 
 def ft_to_m(x_ft: float) -> float:
-    return x_ft * 0.3048
+    return x_ft * FT_TO_M
 
 def kg_per_m3_to_g_per_cc(x: float) -> float:
     return x / 1000.0
 
+@njit(cache=True)
 def area_of_hole(diam_m: float) -> float:
-    r = diam_m / 2.0
-    return math.pi * r * r
+    return _PI_OVER_4 * diam_m * diam_m
 
 def parse_float(s, default=None):
+    if s is None:  # the usual case: key not given, use the default
+        return default
     try:
         return float(s)
-    except:
+    except (ValueError, TypeError):
         return default
 
 # ---------------------------
 # Minimal knowledge base (curated facts)
 # ---------------------------
-KB = [
-    {
-        "q": "What is powder factor?",
-        "a": "Powder Factor (PF) is the mass of explosive used divided by the rock volume broken. Units often kg/m³ (metric) or lb/yd³ (imperial). Typical surface bench blasting values range ~0.3–1.0 kg/m³ depending on rock strength, fragmentation target, and energy of the explosive."
-    },
-    {
-        "q": "How do I estimate burden and spacing?",
-        "a": "A common starting point for bench blasting (ANFO/ANFO blends) is: Burden B ≈ (25–35) × hole diameter (in mm) / 1000 (m), or B ≈ 25–40×D (in) in inches. Spacing S ≈ 1.15–1.4 × B. Adjust for rock mass quality, stiffness, and energy."
-    },
-    {
-        "q": "What is stemming and how much should I use?",
-        "a": "Stemming is inert material at the top of the hole to confine gases. A quick rule: stemming length T ≈ 0.7–1.0 × burden (bench blasting), or T ≈ 20–30 × hole diameter (in mm), whichever suits fragmentation and flyrock control."
-    },
-    {
-        "q": "How do I compute charge per hole?",
-        "a": "Charge per hole (kg) = explosive density (kg/m³) × hole cross-section area (m²) × charged length (m). Charged length is typically (bench height + subdrill – stemming)."
-    },
-    {
-        "q": "What is scaled distance and why is it used?",
-        "a": "Scaled Distance (SD) = distance (m) / sqrt(charge per delay, kg). It correlates with ground vibration. Lower SD implies higher vibration. Site-specific constants are required for accurate PPV prediction."
-    },
-    {
-        "q": "How do initiation and delays affect results?",
-        "a": "Using short-delay intervals between holes/rows reduces instantaneous charge per delay, improves muckpile throw and fragmentation, and helps control vibration. Keep actual per-delay charge consistent with design assumptions."
-    },
-    {
-        "q": "How to reduce flyrock?",
-        "a": "Avoid overcharging, increase stemming or burden (within limits), improve hole collar quality, check for decking voids, and ensure accurate drilling to design angles and positions."
-    },
-    {
-        "q": "What to do in case of a misfire?",
-        "a": "Follow site SOPs: secure the area, notify supervisor/blaster-in-charge, mark and record the hole, forbid drilling or digging near the misfire, and only re-initiate or make safe under approved procedures with proper clearance."
-    },
-    {
-        "q": "How do water conditions affect explosive choice?",
-        "a": "In dry holes, ANFO is economical. In wet or dynamic water, use water-resistant emulsions or heavy ANFO blends. Consider gas generation, density, and energy with supplier tech sheets."
-    },
-    {
-        "q": "What inputs do I need to design a bench blast?",
-        "a": "Rock properties (UCS/RQD/JSA), bench height, hole diameter, explosive density & energy, desired fragmentation, face conditions, equipment dig/haul constraints, environmental limits (vibration, airblast), and safety/legal standards."
-    },
-]
+# parallel tuples: KB_A[i] answers KB_Q[i]
+KB_Q: Tuple[str, ...] = (
+    "What is powder factor?",
+    "How do I estimate burden and spacing?",
+    "What is stemming and how much should I use?",
+    "How do I compute charge per hole?",
+    "What is scaled distance and why is it used?",
+    "How do initiation and delays affect results?",
+    "How to reduce flyrock?",
+    "What to do in case of a misfire?",
+    "How do water conditions affect explosive choice?",
+    "What inputs do I need to design a bench blast?",
+)
+KB_A: Tuple[str, ...] = (
+    "Powder Factor (PF) is the mass of explosive used divided by the rock volume broken. Units often kg/m³ (metric) or lb/yd³ (imperial). Typical surface bench blasting values range ~0.3–1.0 kg/m³ depending on rock strength, fragmentation target, and energy of the explosive.",
+    "A common starting point for bench blasting (ANFO/ANFO blends) is: Burden B ≈ (25–35) × hole diameter (in mm) / 1000 (m), or B ≈ 25–40×D (in) in inches. Spacing S ≈ 1.15–1.4 × B. Adjust for rock mass quality, stiffness, and energy.",
+    "Stemming is inert material at the top of the hole to confine gases. A quick rule: stemming length T ≈ 0.7–1.0 × burden (bench blasting), or T ≈ 20–30 × hole diameter (in mm), whichever suits fragmentation and flyrock control.",
+    "Charge per hole (kg) = explosive density (kg/m³) × hole cross-section area (m²) × charged length (m). Charged length is typically (bench height + subdrill – stemming).",
+    "Scaled Distance (SD) = distance (m) / sqrt(charge per delay, kg). It correlates with ground vibration. Lower SD implies higher vibration. Site-specific constants are required for accurate PPV prediction.",
+    "Using short-delay intervals between holes/rows reduces instantaneous charge per delay, improves muckpile throw and fragmentation, and helps control vibration. Keep actual per-delay charge consistent with design assumptions.",
+    "Avoid overcharging, increase stemming or burden (within limits), improve hole collar quality, check for decking voids, and ensure accurate drilling to design angles and positions.",
+    "Follow site SOPs: secure the area, notify supervisor/blaster-in-charge, mark and record the hole, forbid drilling or digging near the misfire, and only re-initiate or make safe under approved procedures with proper clearance.",
+    "In dry holes, ANFO is economical. In wet or dynamic water, use water-resistant emulsions or heavy ANFO blends. Consider gas generation, density, and energy with supplier tech sheets.",
+    "Rock properties (UCS/RQD/JSA), bench height, hole diameter, explosive density & energy, desired fragmentation, face conditions, equipment dig/haul constraints, environmental limits (vibration, airblast), and safety/legal standards.",
+)
 
 # Simple bag-of-words retrieval (tiny BM25-like)
-def tokenize(text: str) -> List[str]:
-    return re.findall(r"[a-z0-9]+", text.lower())
-
-VOCAB = {}
-DOCS = []
-for item in KB:
-    text = (item["q"] + " " + item["a"]).lower()
-    tokens = tokenize(text)
-    DOCS.append(tokens)
-    for t in set(tokens):
-        VOCAB[t] = VOCAB.get(t, 0) + 1
-
-def bm25_like(query: str, k1=1.5, b=0.75) -> List[Tuple[int, float]]:
-    N = len(DOCS)
-    avgdl = sum(len(d) for d in DOCS) / N
-    q_terms = tokenize(query)
-    scores = [0.0] * N
-    for qi in set(q_terms):
-        n_qi = VOCAB.get(qi, 0)
-        if n_qi == 0:
-            continue
-        idf = math.log((N - n_qi + 0.5) / (n_qi + 0.5) + 1.0)
-        for idx, doc in enumerate(DOCS):
-            f = doc.count(qi)
-            dl = len(doc)
-            denom = f + k1 * (1 - b + b * (dl / avgdl))
-            score = idf * (f * (k1 + 1)) / (denom if denom != 0 else 1)
-            scores[idx] += score
-    return sorted(list(enumerate(scores)), key=lambda x: x[1], reverse=True)
+def tokenize(text_lower: str) -> List[str]:
+    return TOKEN_RE.findall(text_lower)
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+@st.cache_resource(show_spinner=False)
+def _build_index(b: float = BM25_B):
+    """
+    Everything BM25 needs that does not depend on the query, built once per
+    process (the KB is immutable): tokenized docs, a term -> column map,
+    the TF[doc, term] count matrix, per-term IDF and the per-doc length
+    norm 1 - b + b*dl/avgdl.
+    """
+    docs = [tokenize((q + " " + a).lower()) for q, a in zip(KB_Q, KB_A)]
+    doc_counts = [Counter(d) for d in docs]
+    vocab = Counter()  # term -> number of docs containing it
+    for c in doc_counts:
+        vocab.update(c.keys())
+
+    n = len(docs)
+    term_id = {t: j for j, t in enumerate(vocab)}
+    tf = np.zeros((n, len(term_id)), dtype=np.int16)
+    for idx, c in enumerate(doc_counts):
+        tf[idx, [term_id[t] for t in c]] = list(c.values())
+    doc_len = np.fromiter((len(d) for d in docs), dtype=np.int32, count=n)
+    df = np.array(list(vocab.values()))  # in term_id order
+    idf = np.log((n - df + 0.5) / (df + 0.5) + 1.0)
+    norm = 1 - b + b * (doc_len / doc_len.mean())
+    return docs, term_id, tf, idf, norm
+
+DOCS, TERM_ID, TF, IDF, NORM = _build_index()
+N_DOCS = len(DOCS)
+
+@njit(cache=True, fastmath=True)
+def _bm25_kernel(tf_cols, idf_cols, norm, k1):
+    scores = np.zeros(norm.shape[0])
+    for j in range(tf_cols.shape[1]):
+        for i in range(tf_cols.shape[0]):
+            f = tf_cols[i, j]
+            if f:
+                scores[i] += idf_cols[j] * (f * (k1 + 1)) / (f + k1 * norm[i])
+    return scores
+
+@st.cache_resource(show_spinner=False)
+def _warm_bm25_kernel() -> threading.Thread:
+    # once per process: compile the kernel off the main thread so the first
+    # query doesn't wait on numba; later reruns load it from the disk cache
+    t = threading.Thread(
+        target=_bm25_kernel, args=(np.ascontiguousarray(TF[:, [0]]), IDF[[0]], NORM, BM25_K1), daemon=True
+    )
+    t.start()
+    return t
+
+if HAVE_NUMBA:  # nothing to compile with the plain-Python fallback
+    _warm_bm25_kernel()
+
+def _score(query: str, k1=BM25_K1) -> np.ndarray:
+    """BM25 score of every doc for an already-lowercased query."""
+    cols = [TERM_ID[t] for t in set(tokenize(query)) if t in TERM_ID]
+    return _bm25_kernel(np.ascontiguousarray(TF[:, cols]), IDF[cols], NORM, k1)
+
+def bm25_top1(query: str) -> int:
+    """Index of the best doc; argmax keeps the first on ties, i.e. KB order."""
+    return int(np.argmax(_score(query)))
+
+def bm25_like(query: str, k1=BM25_K1, top_k=None) -> List[Tuple[int, float]]:
+    """
+    (doc_idx, score) pairs for an already-lowercased query, best first; ties
+    keep KB order. top_k=None ranks all docs. For inspecting rankings;
+    retrieve_answer only needs bm25_top1.
+    """
+    scores = _score(query, k1)
+    if top_k is None or top_k >= N_DOCS:
+        ids = np.argsort(-scores, kind="stable")
+    else:
+        # argpartition finds the k-th best score in O(N); take everything
+        # above it plus the first tied docs, so ties resolve like a stable sort
+        kth = -np.partition(-scores, top_k - 1)[top_k - 1]
+        above = np.flatnonzero(scores > kth)
+        ids = np.concatenate([above, np.flatnonzero(scores == kth)[:top_k - len(above)]])
+        ids = ids[np.argsort(-scores[ids], kind="stable")]
+    return list(zip(ids.tolist(), scores[ids].tolist()))
 
 # ---------------------------
 # Chatbot brain (router)
 # ---------------------------
 
-def handle_calculations(message: str, defaults: Dict) -> Tuple[bool, str]:
-    msg = message.lower()
-
-    # Extract common numbers if the user writes like "H=10m, D=165mm, rho=1000"
-    nums = dict(re.findall(r"(b|s|h|j|t|d|rho|pf)\s*=\s*([0-9]*\.?[0-9]+)", msg))
-
-    # Calculator: Powder Factor (also reports charge per hole)
-    if "powder factor" in msg or re.search(r"\bpf\b", msg):
-        H = parse_float(nums.get("h"), defaults["H"])
-        B = parse_float(nums.get("b"), defaults["B"])
-        S = parse_float(nums.get("s"), defaults["S"])
-        J = parse_float(nums.get("j"), defaults["J"])
-        T = parse_float(nums.get("t"), defaults["T"])
-        D = parse_float(nums.get("d"), defaults["D"])
-        rho = parse_float(nums.get("rho"), defaults["rho"])
-
-        diam_m = D / 1000.0  # mm -> m
-        area = area_of_hole(diam_m)
-        charged_len = max(H + J - T, 0.0)
-        charge_per_hole = rho * area * charged_len  # kg
-        rock_volume = B * S * H  # m3
-        pf = (charge_per_hole / rock_volume) if rock_volume > 0 else 0.0
-
-        return True, (
-            f"🔢 **Powder Factor Calculator**\n\n"
-            f"- Hole diameter D: **{D:.1f} mm**  \n"
-            f"- Bench height H: **{H:.2f} m**, Subdrill J: **{J:.2f} m**, Stemming T: **{T:.2f} m**  \n"
-            f"- Burden B: **{B:.2f} m**, Spacing S: **{S:.2f} m**  \n"
-            f"- Explosive density ρ: **{rho:.0f} kg/m³**  \n\n"
-            f"**Charged length** = H + J − T = **{charged_len:.2f} m**  \n"
-            f"**Charge per hole** = ρ × area × charged_len = **{charge_per_hole:.1f} kg**  \n"
-            f"**Rock volume per hole** = B × S × H = **{rock_volume:.2f} m³**  \n"
-            f"**Powder Factor (PF)** = charge/volume = **{pf:.3f} kg/m³**"
-        )
-
-    # Calculator: Scaled Distance (vibration proxy)
-    if "scaled distance" in msg or re.search(r"\bsd\b", msg) or "vibration" in msg:
-        m_dist = re.search(r"(\d+\.?\d*)\s*(m|meter|metre|ft)\b", msg)
-        m_charge = re.search(r"(\d+\.?\d*)\s*(kg|lb)\b", msg)
-        if m_dist and m_charge:
-            dist_val = float(m_dist.group(1))
-            if m_dist.group(2) == "ft":
-                dist_m = ft_to_m(dist_val)
-            else:
-                dist_m = dist_val
-            q = float(m_charge.group(1))
-            if m_charge.group(2) == "lb":
-                q *= 0.453592
-            if q <= 0:
-                return True, "Please provide a positive charge mass per delay."
-            sd = dist_m / math.sqrt(q)
-            return True, f"📉 **Scaled Distance (metric)** = distance / √charge_per_delay = **{sd:.2f} m/√kg**"
+@njit(cache=True)
+def _compute_pf(H, J, T, B, S, D, rho):
+    """(area, charged_len, charge_per_hole, rock_volume, pf) for one hole design."""
+    diam_m = D / 1000.0  # mm -> m
+    area = area_of_hole(diam_m)
+    charged_len = max(H + J - T, 0.0)
+    charge_per_hole = rho * area * charged_len  # kg
+    rock_volume = B * S * H  # m3
+    pf = (charge_per_hole / rock_volume) if rock_volume > 0 else 0.0
+    return area, charged_len, charge_per_hole, rock_volume, pf
+
+PF_INPUTS = ("H", "J", "T", "B", "S", "D", "rho")
+
+# Reply templates, filled with str.format
+_PF_TEMPLATE = (
+    "🔢 **Powder Factor Calculator**\n\n"
+    "- Hole diameter D: **{D:.1f} mm**  \n"
+    "- Bench height H: **{H:.2f} m**, Subdrill J: **{J:.2f} m**, Stemming T: **{T:.2f} m**  \n"
+    "- Burden B: **{B:.2f} m**, Spacing S: **{S:.2f} m**  \n"
+    "- Explosive density ρ: **{rho:.0f} kg/m³**  \n\n"
+    "**Charged length** = H + J − T = **{charged_len:.2f} m**  \n"
+    "**Charge per hole** = ρ × area × charged_len = **{charge_per_hole:.1f} kg**  \n"
+    "**Rock volume per hole** = B × S × H = **{rock_volume:.2f} m³**  \n"
+    "**Powder Factor (PF)** = charge/volume = **{pf:.3f} kg/m³**"
+)
+_RULES_TEMPLATE = (
+    "📐 **Starter rules (bench blasting)**  \n"
+    "- Burden B ≈ **{B:.2f} m**  \n"
+    "- Spacing S ≈ **{S:.2f} m**  \n"
+    "- Stemming T ≈ **{T:.2f} m**  \n"
+    "(Assumed D={D:.0f} mm; tweak for your rock/energy constraints.)"
+)
+
+def _calc_pf(msg: str, defaults: Dict) -> str:
+    """Powder Factor (also reports charge per hole)."""
+    # Numbers the user wrote like "H=10m, D=165mm, rho=1000" override the defaults
+    nums = dict(NUMS_RE.findall(msg))
+    H, J, T, B, S, D, rho = (parse_float(nums.get(k.lower()), defaults[k]) for k in PF_INPUTS)
+
+    area, charged_len, charge_per_hole, rock_volume, pf = _compute_pf(H, J, T, B, S, D, rho)
+
+    return _PF_TEMPLATE.format(
+        D=D, H=H, J=J, T=T, B=B, S=S, rho=rho,
+        charged_len=charged_len, charge_per_hole=charge_per_hole,
+        rock_volume=rock_volume, pf=pf,
+    )
+
+def _calc_sd(msg: str, defaults: Dict) -> str:
+    """Scaled Distance (vibration proxy)."""
+    m_dist = DIST_RE.search(msg)
+    m_charge = CHARGE_RE.search(msg)
+    if m_dist and m_charge:
+        dist_val = float(m_dist.group(1))
+        if m_dist.group(2) == "ft":
+            dist_m = dist_val * FT_TO_M
         else:
-            return True, "To compute Scaled Distance, include a distance (m or ft) and a charge per delay (kg or lb) in your message."
-
-    # Quick rules for B, S, T
-    if "burden" in msg and "spacing" in msg and any(k in msg for k in ["estimate", "rule", "start"]):
-        D = parse_float(nums.get("d"), defaults["D"])
-        B = 30 * (D / 1000.0)  # ≈ 30 × D(mm) → m
-        S = 1.25 * B
-        T = 25 * (D / 1000.0)  # ≈ 25 × D(mm) → m
-        return True, (
-            f"📐 **Starter rules (bench blasting)**  \n"
-            f"- Burden B ≈ **{B:.2f} m**  \n"
-            f"- Spacing S ≈ **{S:.2f} m**  \n"
-            f"- Stemming T ≈ **{T:.2f} m**  \n"
-            f"(Assumed D={D:.0f} mm; tweak for your rock/energy constraints.)"
-        )
+            dist_m = dist_val
+        q = float(m_charge.group(1))
+        if m_charge.group(2) == "lb":
+            q *= LB_TO_KG
+        if q <= 0:
+            return "Please provide a positive charge mass per delay."
+        sd = dist_m / math.sqrt(q)
+        return f"📉 **Scaled Distance (metric)** = distance / √charge_per_delay = **{sd:.2f} m/√kg**"
+    else:
+        return "To compute Scaled Distance, include a distance (m or ft) and a charge per delay (kg or lb) in your message."
+
+def _calc_rules(msg: str, defaults: Dict) -> str:
+    """Quick rules for B, S, T."""
+    D = parse_float(dict(NUMS_RE.findall(msg)).get("d"), defaults["D"])
+    B = 30 * (D / 1000.0)  # ≈ 30 × D(mm) → m
+    S = 1.25 * B
+    T = 25 * (D / 1000.0)  # ≈ 25 × D(mm) → m
+    return _RULES_TEMPLATE.format(B=B, S=S, T=T, D=D)
+
+# (required INTENT_RE groups) -> calculator, in priority order
+_CALC_HANDLERS = {
+    frozenset({"pf"}):                        _calc_pf,
+    frozenset({"sd"}):                        _calc_sd,
+    frozenset({"burden", "spacing", "rule"}): _calc_rules,
+}
+
+def handle_calculations(msg: str, defaults: Dict) -> Tuple[bool, str]:
+    # msg is already lowercased by reply(); every intent keyword in one scan,
+    # then each calculator is a set-inclusion test on the labels that matched
+    hits = {m.lastgroup for m in INTENT_RE.finditer(msg)}
+    for groups, handler in _CALC_HANDLERS.items():
+        if groups <= hits:
+            return True, handler(msg, defaults)
 
     return False, ""
 
-def retrieve_answer(message: str) -> str:
-    ranks = bm25_like(message)
-    top_idx, _ = ranks[0]
-    item = KB[top_idx]
+def retrieve_answer(msg: str) -> str:
+    top_idx = bm25_top1(msg)
     suggestion = ""
-    if any(k in message.lower() for k in ["calculate", "how much", "compute", "powder factor", " pf", "pf "]):
+    if CALC_HINT_RE.search(msg):
         suggestion = "\n\nTry: 'PF h=10 b=3 s=3 j=0.5 t=2 d=165 rho=1000'"
-    return f"**{item['q']}**\n{item['a']}{suggestion}"
+    return f"**{KB_Q[top_idx]}**\n{KB_A[top_idx]}{suggestion}"
 
 # ---------------------------
 # Streamlit UI
@@ -236,36 +328,51 @@ st.markdown("""
 - Give starter rules for bench blast design.
 """)
 
-# Chat history
+# Chat history, capped so a long session doesn't keep re-rendering every old message
+MAX_HISTORY = 200
 if "messages" not in st.session_state:
-    st.session_state.messages = [
+    st.session_state.messages = deque(maxlen=MAX_HISTORY)
+    st.session_state.messages.append(
         {"role": "assistant", "content": "Hi! Ask me anything about drilling & blasting. For PF, try: 'PF h=10 b=3 s=3 j=0.5 t=2 d=165 rho=1000'."}
-    ]
-
-# Render history
-for m in st.session_state.messages:
-    with st.chat_message(m["role"]):
-        st.markdown(m["content"])
-
-# Input
-prompt = st.chat_input("Type your drilling & blasting question…")
+    )
 
-def reply(user_text: str):
-    handled, answer = handle_calculations(user_text, st.session_state.defaults)
+@st.cache_data(max_entries=512, show_spinner=False)
+def _cached_reply(msg: str, defaults_key: Tuple[Tuple[str, float], ...]) -> str:
+    # defaults_key is the sorted defaults items, so editing a sidebar input
+    # misses the cache instead of returning a reply built on stale values
+    handled, answer = handle_calculations(msg, dict(defaults_key))
     if handled:
         return answer
-    return retrieve_answer(user_text)
-
-if prompt:
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
+    return retrieve_answer(msg)
 
-    answer = reply(prompt)
-
-    st.session_state.messages.append({"role": "assistant", "content": answer})
-    with st.chat_message("assistant"):
-        st.markdown(answer)
+def reply(user_text: str):
+    # lowercase once here; everything downstream takes the lowered text
+    return _cached_reply(user_text.lower(), tuple(sorted(st.session_state.defaults.items())))
+
+@st.fragment
+def chat_fragment():
+    """
+    History + input. Sending a message reruns only this, not the page and
+    sidebar. Inside a fragment Streamlit 1.37 draws st.chat_input inline
+    under the history instead of pinned to the page bottom.
+    """
+    for m in st.session_state.messages:
+        with st.chat_message(m["role"]):
+            st.markdown(m["content"])
+
+    prompt = st.chat_input("Type your drilling & blasting question…")
+    if prompt:
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        answer = reply(prompt)
+
+        st.session_state.messages.append({"role": "assistant", "content": answer})
+        with st.chat_message("assistant"):
+            st.markdown(answer)
+
+chat_fragment()
 
 st.markdown("---")
 st.caption("⚠️ This tool is for learning and preliminary planning. Always comply with applicable laws, standards, and your site's blast management plan under a licensed blaster.")